@@ -0,0 +1,34 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+import numpy as np
+from libc.stdlib cimport strtod, strtol
+
+
+def parse_terms(bytes buf):
+    """
+    Scans the "<coefficient> x<index>" terms of a block of LP file bytes
+    and returns their zero based variable indices and coefficients.
+    """
+    cdef const char* p = buf
+    cdef const char* stop = p + len(buf)
+    cdef char* end
+    cdef char* index_end
+    cdef double val
+    cdef Py_ssize_t count = 0
+    # every term contains " x", so this bounds the number of terms
+    indices = np.empty(buf.count(b" x"), dtype=np.intp)
+    values = np.empty(len(indices), dtype=np.float64)
+    cdef Py_ssize_t[:] indices_view = indices
+    cdef double[:] values_view = values
+    while p < stop:
+        val = strtod(p, &end)
+        if <const char*>end == p:
+            p += 1
+            continue
+        # bytes are null terminated so peeking past the number is safe
+        if end[0] == c" " and end[1] == c"x" and c"0" <= end[2] <= c"9":
+            indices_view[count] = strtol(end + 2, &index_end, 10) - 1
+            values_view[count] = val
+            count += 1
+            end = index_end
+        p = end
+    return indices[:count], values[:count]
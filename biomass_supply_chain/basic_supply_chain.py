@@ -1,7 +1,6 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import numpy.random as rnd
-import cartopy.crs as ccrs
+from collections import namedtuple
+from scipy.spatial.distance import cdist
 from pyomo.environ import (
     Var,
     NonNegativeReals,
@@ -9,57 +8,56 @@ from pyomo.environ import (
     ConstraintList,
     Objective,
     minimize,
-    SolverFactory,
+    quicksum,
 )
+from pyomo.core.expr.numeric_expr import LinearExpression
+from pyomo.contrib import appsi
 
-rnd.seed(100000)
+rng = np.random.default_rng(100000)
 
+# node coordinates in degrees, stored as separate contiguous arrays
+NodeSet = namedtuple("NodeSet", "lat lon")
 
-def place_nodes(supply_nodes, demand_nodes):
+
+def place_nodes(supply_nodes, demand_nodes, rng):
     """
     Places supply and demand nodes randomly on a sphere,
     returns degrees and NOT radians
     """
     total_nodes = supply_nodes + demand_nodes
-    locations = rnd.uniform([-180, -90], [180, 90], (total_nodes, 2))
-    supply_locations = locations[:supply_nodes, :]
-    demand_locations = locations[supply_nodes:, :]
+    lon = rng.uniform(-180, 180, total_nodes)
+    lat = rng.uniform(-90, 90, total_nodes)
+    supply_locations = NodeSet(lat[:supply_nodes], lon[:supply_nodes])
+    demand_locations = NodeSet(lat[supply_nodes:], lon[supply_nodes:])
     return supply_locations, demand_locations
 
 
-def distance_on_sphere(point1, point2):
+def unit_vectors(lat, lon):
     """
-    Calculates the distance between two coordinates on a sphere (in radians)
-    In this case Earth.
-    point1: [Lon,Lat]
-    point2: [Lon,Lat]
+    Converts latitudes and longitudes in degrees to
+    cartesian points on the unit sphere.
     """
-    earth_r = 6371
-    delta = point2 - point1
-    a = (
-        np.sin(delta[1] / 2) ** 2
-        + np.cos(point1[1]) * np.cos(point2[1]) * np.sin(delta[0] / 2) ** 2
+    lon = np.deg2rad(lon)
+    lat = np.deg2rad(lat)
+    return np.column_stack(
+        (np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat))
     )
-    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
-    distance = earth_r * c
-    return distance
 
 
-def calculate_distances(supply_locations, demand_locations):
+def calculate_distances(supply_points, demand_points):
     """
-    Calculates the distance between supply and demand nodes on a sphere
-    and returns corresponding matrix.
+    Calculates the distance between supply and demand nodes on a sphere,
+    given as points from unit_vectors, and returns corresponding matrix.
     Distances are in km.
     """
-    num_supply = len(supply_locations)
-    num_demand = len(demand_locations)
-    distance_matrix = np.zeros((num_supply, num_demand))
-    factor = np.pi / 180.0
-    for i in range(num_supply):
-        rad_supply = supply_locations[i, :] * factor
-        for j in range(num_demand):
-            rad_demand = demand_locations[j, :] * factor
-            distance_matrix[i, j] = distance_on_sphere(rad_supply, rad_demand)
+    earth_r = 6371
+    # chord between points on the unit sphere, mapped back to the arc length
+    # in place so no further matrix sized temporaries are allocated
+    distance_matrix = cdist(supply_points, demand_points)
+    distance_matrix /= 2
+    np.minimum(distance_matrix, 1, out=distance_matrix)
+    np.arcsin(distance_matrix, out=distance_matrix)
+    distance_matrix *= 2 * earth_r
     return distance_matrix
 
 
@@ -70,24 +68,35 @@ def plot_nodes(
     Given the location of supply and demand nodes,
     plots them and their connections on a projection.
     """
+    import matplotlib.pyplot as plt
+    import cartopy.crs as ccrs
+    from matplotlib.collections import LineCollection
+    from matplotlib.lines import Line2D
+
+    supply_sum = supply_vars.sum(axis=1)
+    link_widths = supply_vars * 10
     fig = plt.figure(figsize=(9, 5))
     ax = fig.add_subplot(1, 1, 1, projection=ccrs.Robinson())
     ax.set_global()
-    for i in range(len(supply_locations)):
-        for j in range(len(demand_locations)):
-            ax.plot(
-                [supply_locations[i, 0], demand_locations[j, 0]],
-                [supply_locations[i, 1], demand_locations[j, 1]],
-                transform=ccrs.Geodetic(),
-                color="k",
-                alpha=0.25,
-                linewidth=supply_vars[i, j] * 10,
-                zorder=-1,
-            )
+    # links carrying flow as [[lon, lat], [lon, lat]] segments, zero flow
+    # links are skipped and the rest drawn as one collection
+    supply_idx, demand_idx = np.nonzero(supply_vars > 1e-6)
+    supply_points = np.column_stack((supply_locations.lon, supply_locations.lat))
+    demand_points = np.column_stack((demand_locations.lon, demand_locations.lat))
+    segments = np.stack((supply_points[supply_idx], demand_points[demand_idx]), axis=1)
+    links = LineCollection(
+        segments,
+        transform=ccrs.Geodetic(),
+        color="k",
+        alpha=0.25,
+        linewidths=link_widths[supply_idx, demand_idx],
+        zorder=-1,
+    )
+    ax.add_collection(links)
     ax.gridlines(alpha=0.5)
     ax.scatter(
-        supply_locations[:, 0],
-        supply_locations[:, 1],
+        supply_locations.lon,
+        supply_locations.lat,
         transform=ccrs.Geodetic(),
         color="white",
         edgecolors="k",
@@ -96,54 +105,65 @@ def plot_nodes(
         zorder=1,
         label="Production Limits",
     )
-    supply_sum = np.sum(supply_vars, axis=1)
     ax.scatter(
-        supply_locations[:, 0],
-        supply_locations[:, 1],
+        supply_locations.lon,
+        supply_locations.lat,
         transform=ccrs.Geodetic(),
         color="k",
         edgecolors="k",
         linestyle="dashed",
-        s=supply_sum[:] * 100,
+        s=supply_sum * 100,
         zorder=1,
         label="Actual Production",
     )
 
     demand_color = "tab:blue"
     dm = ax.scatter(
-        demand_locations[:, 0],
-        demand_locations[:, 1],
+        demand_locations.lon,
+        demand_locations.lat,
         transform=ccrs.Geodetic(),
         color=demand_color,
         s=demand_amounts[:, 0] * 100,
         zorder=1,
         label="Demand",
     )
-    type_legend = plt.legend(loc="upper left")
+    # fixed size markers for the node types, sizes are shown by the quantity legend
+    marker = dict(marker="o", linestyle="None", markersize=np.sqrt(50))
+    type_handles = [
+        Line2D(
+            [],
+            [],
+            color="white",
+            markeredgecolor="k",
+            label="Production Limits",
+            **marker
+        ),
+        Line2D([], [], color="k", label="Actual Production", **marker),
+        Line2D([], [], color=demand_color, label="Demand", **marker),
+    ]
+    type_legend = plt.legend(handles=type_handles, loc="upper left")
     kw = dict(prop="sizes", num=5, color="k", alpha=0.5, func=lambda s: s / 100)
     plt.legend(*dm.legend_elements(**kw), title="Quantity", loc="lower left")
     ax.add_artist(type_legend)
-    type_legend.legendHandles[0]._sizes = [50]
-    type_legend.legendHandles[1]._sizes = [50]
     plt.show()
     return
 
 
-def get_demand_amounts(demand_nodes):
+def get_demand_amounts(demand_nodes, rng):
     demand_limit = 1
-    return np.random.uniform(0, demand_limit, (demand_nodes, 1))
+    return rng.uniform(0, demand_limit, (demand_nodes, 1))
 
 
-def get_production_costs(supply_nodes):
+def get_production_costs(supply_nodes, rng):
     cost_limit = 1
-    return np.random.uniform(0, cost_limit, (supply_nodes, 1))
+    return rng.uniform(0, cost_limit, (supply_nodes, 1))
 
 
-def get_supply_limits(demand_amounts, supply_nodes):
+def get_supply_limits(demand_amounts, supply_nodes, rng):
     full_demand = sum(demand_amounts)
     supply_flexibility = 0.5
     demand_nodes = len(demand_amounts)
-    supply_limits = np.random.uniform(
+    supply_limits = rng.uniform(
         (full_demand / supply_nodes),
         (full_demand / supply_nodes) + supply_flexibility * demand_nodes,
         (supply_nodes, 1),
@@ -151,32 +171,50 @@ def get_supply_limits(demand_amounts, supply_nodes):
     return supply_limits
 
 
-def build_problem(supply_nodes, demand_nodes):
-    supply_locations, demand_locations = place_nodes(supply_nodes, demand_nodes)
+def build_problem(supply_nodes, demand_nodes, rng):
+    supply_locations, demand_locations = place_nodes(supply_nodes, demand_nodes, rng)
     # calculating distances
-    distance_matrix = calculate_distances(supply_locations, demand_locations)
+    distance_matrix = calculate_distances(
+        unit_vectors(*supply_locations), unit_vectors(*demand_locations)
+    )
     # defining demand values
-    demand_amounts = get_demand_amounts(demand_nodes)
+    demand_amounts = get_demand_amounts(demand_nodes, rng)
     # defining supply limits that still result in a feasible problem
-    supply_limits = get_supply_limits(demand_amounts, supply_nodes)
+    supply_limits = get_supply_limits(demand_amounts, supply_nodes, rng)
     # defining cost of production at each supply node
-    production_cost = get_production_costs(supply_nodes)
+    production_cost = get_production_costs(supply_nodes, rng)
 
     m = ConcreteModel()
-    cost = 0
     m.supply_vars = Var(
         range(supply_nodes), range(demand_nodes), domain=NonNegativeReals
     )
+    # variables flattened row by row to line up with ravelled coefficients
+    supply_vars = [
+        m.supply_vars[i, j] for i in range(supply_nodes) for j in range(demand_nodes)
+    ]
+    cost_coefs = (distance_matrix * production_cost).ravel()
+    # scaling the objective to O(1) coefficients for better conditioning,
+    # the unscaled cost is the objective value multiplied by this factor
+    objective_scale = np.amax(cost_coefs)
+    cost_coefs /= objective_scale
     m.production_constraints = ConstraintList()
     for i in range(supply_nodes):
-        limit = sum(m.supply_vars[i, :]) <= supply_limits[i, 0]
-        m.production_constraints.add(expr=limit)
-        for j in range(demand_nodes):
-            cost += m.supply_vars[i, j] * distance_matrix[i, j] * production_cost[i, 0]
+        row_sum = LinearExpression(
+            constant=0,
+            linear_coefs=[1.0] * demand_nodes,
+            linear_vars=supply_vars[i * demand_nodes : (i + 1) * demand_nodes],
+        )
+        m.production_constraints.add(expr=row_sum <= supply_limits[i, 0])
     m.demand_constraints = ConstraintList()
     for i in range(demand_nodes):
-        demand_constraint = sum(m.supply_vars[:, i]) >= demand_amounts[i, 0]
+        demand_constraint = (
+            quicksum(m.supply_vars[j, i] for j in range(supply_nodes))
+            >= demand_amounts[i, 0]
+        )
         m.demand_constraints.add(expr=demand_constraint)
+    cost = LinearExpression(
+        constant=0, linear_coefs=cost_coefs.tolist(), linear_vars=supply_vars
+    )
     m.objective = Objective(expr=cost, sense=minimize)
     dict = {}
     dict["model"] = m
@@ -184,25 +222,41 @@ def build_problem(supply_nodes, demand_nodes):
     dict["demand_locations"] = demand_locations
     dict["demand_amounts"] = demand_amounts
     dict["supply_limits"] = supply_limits
+    dict["objective_scale"] = objective_scale
     return dict
 
 
-supply_nodes = 10
-demand_nodes = 50
-problem = build_problem(supply_nodes, demand_nodes)
-results = SolverFactory("ipopt").solve(problem["model"])
-results.write()
-supply_vars = (
-    np.array(problem["model"].supply_vars[:, :]())
-    .reshape((supply_nodes, demand_nodes))
-    .clip(min=0)
-)
+def solve_problem(model, solver=None):
+    """
+    Solves the model with the APPSI HiGHS interface, reusing solver if given
+    """
+    if solver is None:
+        solver = appsi.solvers.Highs()
+    return solver.solve(model)
 
-# plotting nodes
-plot_nodes(
-    problem["supply_locations"],
-    problem["demand_locations"],
-    problem["demand_amounts"],
-    problem["supply_limits"],
-    supply_vars,
-)
+
+def main():
+    supply_nodes = 10
+    demand_nodes = 50
+    problem = build_problem(supply_nodes, demand_nodes, rng)
+    results = solve_problem(problem["model"])
+    print("Termination condition:", results.termination_condition)
+    print("Total cost:", results.best_feasible_objective * problem["objective_scale"])
+    supply_vars = (
+        np.array(problem["model"].supply_vars[:, :]())
+        .reshape((supply_nodes, demand_nodes))
+        .clip(min=0)
+    )
+
+    # plotting nodes
+    plot_nodes(
+        problem["supply_locations"],
+        problem["demand_locations"],
+        problem["demand_amounts"],
+        problem["supply_limits"],
+        supply_vars,
+    )
+
+
+if __name__ == "__main__":
+    main()
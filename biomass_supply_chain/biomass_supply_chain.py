@@ -1,7 +1,6 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import numpy.random as rnd
-import cartopy.crs as ccrs
+from collections import namedtuple
+from scipy.spatial.distance import cdist
 from pyomo.environ import (
     Var,
     NonNegativeReals,
@@ -9,144 +8,201 @@ from pyomo.environ import (
     ConstraintList,
     Objective,
     minimize,
-    SolverFactory,
+    quicksum,
 )
+from pyomo.core.expr.numeric_expr import LinearExpression
+from pyomo.contrib import appsi
 
+rng = np.random.default_rng()
 
-def place_nodes(nodes):
+# node coordinates in degrees, stored as separate contiguous arrays
+NodeSet = namedtuple("NodeSet", "lat lon")
+
+
+def place_nodes(nodes, rng):
     """
     Places nodes randomly on a sphere,
     returns degrees and NOT radians
     """
-    locations = rnd.uniform([-180, -90], [180, 90], (nodes, 2))
-    return locations
+    lon = rng.uniform(-180, 180, nodes)
+    lat = rng.uniform(-90, 90, nodes)
+    return NodeSet(lat, lon)
 
 
-def place_node_set(nodes_set):
+def place_node_set(nodes_set, rng):
     """
     Takes a list of node set sizes and returns a list of their locations
     """
     node_locations = []
     for nodes in nodes_set:
-        node_locations.append(place_nodes(nodes))
+        node_locations.append(place_nodes(nodes, rng))
     return node_locations
 
 
-def distance_on_sphere(point1, point2):
+def unit_vectors(lat, lon):
     """
-    Calculates the distance between two coordinates on a sphere (in radians)
-    In this case Earth.
-    point1: [Lon,Lat]
-    point2: [Lon,Lat]
+    Converts latitudes and longitudes in degrees to
+    cartesian points on the unit sphere.
     """
-    earth_r = 6371
-    delta = point2 - point1
-    a = (
-        np.sin(delta[1] / 2) ** 2
-        + np.cos(point1[1]) * np.cos(point2[1]) * np.sin(delta[0] / 2) ** 2
+    lon = np.deg2rad(lon)
+    lat = np.deg2rad(lat)
+    return np.column_stack(
+        (np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat))
     )
-    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
-    distance = earth_r * c
-    return distance
 
 
-def calculate_distances(node_set_1, node_set_2):
+def calculate_distances(points_1, points_2):
     """
-    Calculates the distance between two sets of nodes on a sphere.
+    Calculates the distance between two sets of nodes on a sphere,
+    given as points from unit_vectors.
     Returns corresponding matrix of distances.
     Distances are in km.
     """
-    num_1 = len(node_set_1)
-    num_2 = len(node_set_2)
-    distance_matrix = np.zeros((num_1, num_2))
-    factor = np.pi / 180.0
-    for i in range(num_1):
-        rad_1 = node_set_1[i, :] * factor
-        for j in range(num_2):
-            rad_2 = node_set_2[j, :] * factor
-            distance_matrix[i, j] = distance_on_sphere(rad_1, rad_2)
+    earth_r = 6371
+    # chord between points on the unit sphere, mapped back to the arc length
+    # in place so no further matrix sized temporaries are allocated
+    distance_matrix = cdist(points_1, points_2)
+    distance_matrix /= 2
+    np.minimum(distance_matrix, 1, out=distance_matrix)
+    np.arcsin(distance_matrix, out=distance_matrix)
+    distance_matrix *= 2 * earth_r
     return distance_matrix
 
 
-def get_random_parameters(amount, limit):
-    return rnd.uniform(0, limit, (amount, 1))
+def get_random_parameters(amount, limit, rng):
+    return rng.uniform(0, limit, (amount, 1))
 
 
-def build_problem(production_nodes, processing_nodes, demand_nodes):
+def build_problem(production_nodes, processing_nodes, demand_nodes, rng, executor=None):
 
     [production_locations, processing_locations, demand_locations] = place_node_set(
-        [production_nodes, processing_nodes, demand_nodes]
+        [production_nodes, processing_nodes, demand_nodes], rng
     )
-    # calculating distances
-    production_distance_matrix = calculate_distances(
-        production_locations, processing_locations
+    # converting each node set to points on the unit sphere once
+    production_points = unit_vectors(*production_locations)
+    processing_points = unit_vectors(*processing_locations)
+    demand_points = unit_vectors(*demand_locations)
+    # calculating distances, the two matrices are independent so an executor
+    # (e.g. a ThreadPoolExecutor for large node sets) may compute them together
+    mapper = map if executor is None else executor.map
+    production_distance_matrix, demand_distance_matrix = mapper(
+        calculate_distances,
+        (production_points, processing_points),
+        (processing_points, demand_points),
     )
-    demand_distance_matrix = calculate_distances(processing_locations, demand_locations)
     # defining demand values
-    demand_amounts = get_random_parameters(demand_nodes, 1)
+    demand_amounts = get_random_parameters(demand_nodes, 1, rng)
     # defining production limits that still result in a feasible problem
-    production_limits = get_random_parameters(production_nodes, 5)
+    production_limits = get_random_parameters(production_nodes, 5, rng)
     # defining cost of production at each production node
-    production_cost = get_random_parameters(production_nodes, 2)
+    production_cost = get_random_parameters(production_nodes, 2, rng)
     # defining processing limits
-    processing_limits = get_random_parameters(processing_nodes, 10)
+    processing_limits = get_random_parameters(processing_nodes, 10, rng)
     # defining processing cost at each processing node
-    processing_cost = get_random_parameters(processing_nodes, 1)
+    processing_cost = get_random_parameters(processing_nodes, 1, rng)
 
     m = ConcreteModel()
-    cost = 0
     m.production_vars = Var(
         range(production_nodes), range(processing_nodes), domain=NonNegativeReals
     )
     m.distribution_vars = Var(
         range(processing_nodes), range(demand_nodes), domain=NonNegativeReals
     )
+    # variables flattened row by row to line up with ravelled coefficients
+    production_vars = [
+        m.production_vars[i, j]
+        for i in range(production_nodes)
+        for j in range(processing_nodes)
+    ]
+    distribution_vars = [
+        m.distribution_vars[i, j]
+        for i in range(processing_nodes)
+        for j in range(demand_nodes)
+    ]
+    # Production cost of each production node plus cost of transport
+    # to each processing node
+    production_coefs = (production_distance_matrix + production_cost).ravel()
+    # Processing cost of each processing node plus cost of transport
+    # to each demand node
+    distribution_coefs = (demand_distance_matrix + processing_cost).ravel()
+    objective_coefs = np.concatenate((production_coefs, distribution_coefs))
+    objective_vars = production_vars + distribution_vars
+
     m.production_constraints = ConstraintList()
     for i in range(production_nodes):
         # Production limit constraint of each production node
-        limit = sum(m.production_vars[i, :]) <= production_limits[i, 0]
-        m.production_constraints.add(expr=limit)
-        # Adding production cost of each production node to cost
-        cost += sum(m.production_vars[i, :]) * production_cost[i, 0]
-        for j in range(processing_nodes):
-            # Adding cost of transport to each processing node per production node
-            cost += m.production_vars[i, j] * production_distance_matrix[i, j]
+        production_sum = LinearExpression(
+            constant=0,
+            linear_coefs=[1.0] * processing_nodes,
+            linear_vars=production_vars[
+                i * processing_nodes : (i + 1) * processing_nodes
+            ],
+        )
+        m.production_constraints.add(expr=production_sum <= production_limits[i, 0])
 
     m.processing_constraints = ConstraintList()
     for i in range(processing_nodes):
-        # Adding limit on processing amount per processing node
-        m.processing_constraints.add(
-            expr=sum(m.distribution_vars[i, :]) <= processing_limits[i, 0]
+        distribution_sum = LinearExpression(
+            constant=0,
+            linear_coefs=[1.0] * demand_nodes,
+            linear_vars=distribution_vars[i * demand_nodes : (i + 1) * demand_nodes],
         )
+        # Adding limit on processing amount per processing node
+        m.processing_constraints.add(expr=distribution_sum <= processing_limits[i, 0])
         # Adding mass balance on each processing node
         m.processing_constraints.add(
-            expr=sum(m.distribution_vars[i, :]) == sum(m.production_vars[:, i])
+            expr=distribution_sum
+            == quicksum(m.production_vars[j, i] for j in range(production_nodes))
         )
-        # Adding cost of processing to cost function
-        cost += sum(m.distribution_vars[i, :]) * processing_cost[i, 0]
-        # Adding cost of transport to each demand node per production node
-        for j in range(demand_nodes):
-            cost += m.distribution_vars[i, j] * demand_distance_matrix[i, j]
     # Adding minimum demand fulfilment for each demand node
     m.demand_constraints = ConstraintList()
     for i in range(demand_nodes):
         m.processing_constraints.add(
-            expr=sum(m.distribution_vars[:, i]) >= demand_amounts[i, 0]
+            expr=quicksum(m.distribution_vars[j, i] for j in range(processing_nodes))
+            >= demand_amounts[i, 0]
         )
+    cost = LinearExpression(
+        constant=0,
+        linear_coefs=objective_coefs.tolist(),
+        linear_vars=objective_vars,
+    )
     m.objective = Objective(expr=cost, sense=minimize)
+    # the exported LP keeps the unscaled costs, so its objective needs no factor
     m.write("programs/biomass_supply_chain.lp")
+    # scaling the objective to O(1) coefficients for better conditioning,
+    # the unscaled cost is the objective value multiplied by this factor
+    objective_scale = np.amax(objective_coefs)
+    m.objective.set_value(
+        LinearExpression(
+            constant=0,
+            linear_coefs=(objective_coefs / objective_scale).tolist(),
+            linear_vars=objective_vars,
+        )
+    )
     dict = {}
     dict["model"] = m
     dict["production_locations"] = production_locations
     dict["processing_locations"] = processing_locations
     dict["demand_locations"] = demand_locations
+    dict["objective_scale"] = objective_scale
     return dict
 
 
+def solve_problem(model, solver=None):
+    """
+    Solves the model with the APPSI HiGHS interface, reusing solver if given
+    """
+    if solver is None:
+        solver = appsi.solvers.Highs()
+    return solver.solve(model)
+
+
 def plot_nodes(ax, nodes, name, color):
+    import cartopy.crs as ccrs
+
     ax.scatter(
-        nodes[:, 0],
-        nodes[:, 1],
+        nodes.lon,
+        nodes.lat,
         transform=ccrs.Geodetic(),
         color=color,
         s=20,
@@ -157,18 +213,25 @@ def plot_nodes(ax, nodes, name, color):
 
 
 def plot_transport(ax, matrix, loc1, loc2, color):
+    import cartopy.crs as ccrs
+    from matplotlib.collections import LineCollection
+
     matrix = matrix / np.amax(matrix)
-    for i in range(len(loc1)):
-        for j in range(len(loc2)):
-            ax.plot(
-                [loc1[i, 0], loc2[j, 0]],
-                [loc1[i, 1], loc2[j, 1]],
-                transform=ccrs.Geodetic(),
-                color=color,
-                alpha=0.5,
-                linewidth=matrix[i, j] * 5,
-                zorder=-1,
-            )
+    # links carrying flow as [[lon, lat], [lon, lat]] segments, zero flow
+    # links are skipped and the rest drawn as one collection
+    idx_1, idx_2 = np.nonzero(matrix > 1e-6)
+    points_1 = np.column_stack((loc1.lon, loc1.lat))
+    points_2 = np.column_stack((loc2.lon, loc2.lat))
+    segments = np.stack((points_1[idx_1], points_2[idx_2]), axis=1)
+    links = LineCollection(
+        segments,
+        transform=ccrs.Geodetic(),
+        color=color,
+        alpha=0.5,
+        linewidths=matrix[idx_1, idx_2] * 5,
+        zorder=-1,
+    )
+    ax.add_collection(links)
     return
 
 
@@ -179,6 +242,15 @@ def plot_solution(
     processing_vars,
     demand_vars,
 ):
+    import matplotlib.pyplot as plt
+    import cartopy.crs as ccrs
+    from matplotlib.lines import Line2D
+
+    node_types = [
+        (production_locations, "Production", "green"),
+        (processing_locations, "Processing", "tab:blue"),
+        (demand_locations, "Demand", "k"),
+    ]
     fig = plt.figure(figsize=(9, 5))
     ax = fig.add_subplot(1, 1, 1, projection=ccrs.Robinson())
     ax.set_global()
@@ -187,40 +259,55 @@ def plot_solution(
         ax, processing_vars, production_locations, processing_locations, "green"
     )
     plot_transport(ax, demand_vars, processing_locations, demand_locations, "tab:blue")
-    plot_nodes(ax, production_locations, "Production", "green")
-    plot_nodes(ax, processing_locations, "Processing", "tab:blue")
-    plot_nodes(ax, demand_locations, "Demand", "k")
+    for nodes, name, color in node_types:
+        plot_nodes(ax, nodes, name, color)
 
-    type_legend = plt.legend(loc="lower left")
-    for i in range(len(type_legend.legendHandles)):
-        type_legend.legendHandles[i]._sizes = [30]
+    type_handles = [
+        Line2D(
+            [],
+            [],
+            marker="o",
+            linestyle="None",
+            markersize=np.sqrt(30),
+            color=color,
+            label=name,
+        )
+        for _, name, color in node_types
+    ]
+    plt.legend(handles=type_handles, loc="lower left")
     plt.show()
     return
 
 
-production_nodes = 20
-processing_nodes = 10
-demand_nodes = 50
+def main():
+    production_nodes = 20
+    processing_nodes = 10
+    demand_nodes = 50
 
-problem = build_problem(production_nodes, processing_nodes, demand_nodes)
-results = SolverFactory("ipopt").solve(problem["model"])
-results.write()
+    problem = build_problem(production_nodes, processing_nodes, demand_nodes, rng)
+    results = solve_problem(problem["model"])
+    print("Termination condition:", results.termination_condition)
+    print("Total cost:", results.best_feasible_objective * problem["objective_scale"])
 
-production_vars = (
-    np.array(problem["model"].production_vars[:, :]())
-    .reshape((production_nodes, processing_nodes))
-    .clip(min=0)
-)
-distribution_vars = (
-    np.array(problem["model"].distribution_vars[:, :]())
-    .reshape((processing_nodes, demand_nodes))
-    .clip(min=0)
-)
+    production_vars = (
+        np.array(problem["model"].production_vars[:, :]())
+        .reshape((production_nodes, processing_nodes))
+        .clip(min=0)
+    )
+    distribution_vars = (
+        np.array(problem["model"].distribution_vars[:, :]())
+        .reshape((processing_nodes, demand_nodes))
+        .clip(min=0)
+    )
 
-plot_solution(
-    problem["production_locations"],
-    problem["processing_locations"],
-    problem["demand_locations"],
-    production_vars,
-    distribution_vars,
-)
+    plot_solution(
+        problem["production_locations"],
+        problem["processing_locations"],
+        problem["demand_locations"],
+        production_vars,
+        distribution_vars,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,93 +1,106 @@
+import re
 import numpy as np
-import matplotlib.pyplot as plt
+from scipy.sparse import coo_matrix
 
+# coefficient and variable index of a term such as "+1.5 x12"
+_TERM = re.compile(rb"([-+]?[\d.]+(?:[eE][-+]?\d+)?) x(\d+)")
+# sense and right hand side closing a constraint such as "<= 4.2"
+_RHS = re.compile(rb"(<=|>=|=)\s*(\S+)\s*$")
+# two sided variable bound such as "0 <= x1 <= +inf"
+_BOUND = re.compile(rb"(\S+)\s*<=\s*x(\d+)\s*<=\s*(\S+)")
 
-def line_index_val(line):
-    split_line = line.split(" x")
-    index = int(split_line[-1]) - 1
-    val = float(split_line[0])
-    return index, val
 
+def _parse_terms(text):
+    """
+    Returns the zero based variable indices and coefficients
+    of the terms in a block of LP file bytes.
+    """
+    terms = np.array(_TERM.findall(text), dtype=bytes).reshape(-1, 2)
+    return terms[:, 1].astype(int) - 1, terms[:, 0].astype(float)
 
-def parse_bounds(line):
-    split_line = line.split("x")
-    index = int(split_line[-1].split("<")[0]) - 1
-    lb = float(split_line[0].split("<")[0])
-    ub = float(split_line[-1].split("=")[-1])
-    return index, lb, ub
 
+# the compiled scanner in _lp_parse.pyx avoids creating Python objects per
+# term, it is built with `cythonize -i _lp_parse.pyx` and the regex scan is
+# used until then
+try:
+    from _lp_parse import parse_terms
+except ImportError:
+    parse_terms = _parse_terms
 
-def parse_lp(file):
-    with open(file) as f:
-        lines = f.readlines()
-
-    i = 0
-    while "min" not in lines[i]:
-        i += 1
-
-    n = int(lines[i + 1].split("x")[-1].split(":")[0]) - 1
 
+def parse_lp(file):
+    # read as bytes so the term scanner works on the buffer without decoding
+    with open(file, "rb") as f:
+        text = f.read()
+
+    objective, text = text.split(b"s.t.", 1)
+    constraints, bounds = text.split(b"\nbounds", 1)
+
+    # every variable has a bound, listed in model order, which gives the
+    # columns independent of how the LP writer numbers the labels (Pyomo's
+    # lp_v2 writer labels the objective x1 and starts the variables at x2)
+    bound_terms = np.array(_BOUND.findall(bounds), dtype=bytes).reshape(-1, 3)
+    n = len(bound_terms)
+    labels = bound_terms[:, 1].astype(int) - 1
+    column = np.zeros(labels.max() + 1, dtype=int)
+    column[labels] = np.arange(n)
+
+    indices, coefs = parse_terms(objective)
     c = np.zeros((1, n))
+    c[0, column[indices]] = coefs
+
+    # constraint matrix is built from sparse (row, column, value) triplet arrays
+    rows = []
+    cols = []
+    vals = []
+    b = []
+    # constraints are separated by blank lines and end with their sense and rhs
+    for constraint in constraints.split(b"\n\n"):
+        rhs = _RHS.search(constraint)
+        if rhs is None:
+            continue
+        indices, coefs = parse_terms(constraint)
+        if rhs.group(1) == b"<=":
+            signs = [1]
+        elif rhs.group(1) == b">=":
+            signs = [-1]
+        else:
+            signs = [1, -1]
+        for sign in signs:
+            rows.append(np.full(len(indices), len(b)))
+            cols.append(column[indices])
+            vals.append(sign * coefs)
+            b.append(sign * float(rhs.group(2)))
+
+    # each bound gives an upper bound row followed by a negated lower bound row
+    bound_rows = len(b) + np.arange(2 * n)
+    bound_cols = np.repeat(np.arange(n), 2)
+    bound_vals = np.tile([1.0, -1.0], n)
+    bound_b = np.empty(2 * n)
+    bound_b[0::2] = bound_terms[:, 2].astype(float)
+    bound_b[1::2] = -bound_terms[:, 0].astype(float)
+
+    rows.append(bound_rows)
+    cols.append(bound_cols)
+    vals.append(bound_vals)
+
+    A = coo_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(len(b) + 2 * n, n),
+    ).tocsr()
+    b = np.concatenate((b, bound_b))[:, None]
+    return A, b, c
 
-    i += 2
-
-    while "x" in lines[i]:
-        index, val = line_index_val(lines[i])
-        c[:, index] = val
-        i += 1
-
-    while ":" not in lines[i]:
-        i += 1
-    i += 1
-    A = np.zeros((1, n))
-    b = np.zeros((1, 1))
-    while "bounds" not in lines[i]:
-        try:
-            a_row = np.zeros((1, n))
-            b_row = np.zeros((1, 1))
-            while "x" in lines[i]:
-                index, val = line_index_val(lines[i])
-                a_row[:, index] = val
-                i += 1
-            b_row[0, 0] = float(lines[i].split("=")[-1])
-            if "<=" in lines[i]:
-                A = np.append(A, a_row, axis=0)
-                b = np.append(b, b_row, axis=0)
-            elif ">=" in lines[i]:
-                A = np.append(A, -a_row, axis=0)
-                b = np.append(b, -b_row, axis=0)
-            else:
-                A = np.append(A, a_row, axis=0)
-                b = np.append(b, b_row, axis=0)
-                A = np.append(A, -a_row, axis=0)
-                b = np.append(b, -b_row, axis=0)
-            i += 3
-        except ValueError:
-
-            break
-
-    A = A[1:, :]
-    b = b[1:, :]
-
-    while "x" in lines[i]:
-        a_row = np.zeros((1, n))
-        b_row_lb = np.zeros((1, 1))
-        b_row_ub = np.zeros((1, 1))
-        index, lb, ub = parse_bounds(lines[i])
-        a_row[:, index] = 1
-        b_row_lb[0, 0] = lb
-        b_row_ub[0, 0] = ub
-        A = np.append(A, a_row, axis=0)
-        b = np.append(b, b_row_ub, axis=0)
-        A = np.append(A, -a_row, axis=0)
-        b = np.append(b, -b_row_lb, axis=0)
-        i += 1
 
-    return A, b, c
+def main():
+    import matplotlib.pyplot as plt
+
+    A, b, c = parse_lp("biomass_supply_chain.lp")
 
+    plt.figure()
+    plt.spy(A, markersize=1, color="k")
+    plt.show()
 
-A, b, c = parse_lp("biomass_supply_chain.lp")
 
-plt.figure()
-plt.imshow(A, cmap="gray_r", vmin=0, vmax=0.0001)
-plt.show()
+if __name__ == "__main__":
+    main()